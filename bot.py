@@ -10,21 +10,38 @@ import subprocess
 import time
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import signal
 import hashlib
+import functools
+import gzip
+import shutil
+import random
 from pathlib import Path
-from threading import Thread
-from io import BytesIO
+from threading import Thread, Lock, Event
+from collections import deque
 from html import escape as html_escape
+from io import BytesIO
 
 # Try to import PIL for banner generation
 try:
-    from PIL import Image, ImageDraw, ImageFont, ImageFilter
+    from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageFilter
+    # Older Pillow / pillow-simd builds predate the Image.Resampling enum
+    Resampling = getattr(Image, 'Resampling', Image)
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
     print("⚠️  Warning: Pillow not installed. Banner generation disabled.", file=sys.stderr)
     print("   Install with: sudo apt install python3-pil", file=sys.stderr)
+    print("   (or pip install pillow-simd for faster banner compositing)", file=sys.stderr)
+
+# Optional: zstd for log uploads (falls back to gzip)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
 
 # ============================================================================
 # CONFIGURATION
@@ -44,6 +61,10 @@ ROM_DISPLAY_NAME = "AxionOS 2.3"  # Leave empty to auto-detect
 
 # Banner Configuration
 BANNER_COLOR_SCHEME = "axion"  # "axion", "crdroid", "lineage", "arrow", "aosp"
+TAMINARU_FONT = "/home/some8b/.local/share/fonts/t/Taminaru_Regular.otf"
+
+# Console Output
+ECHO_BUILD_OUTPUT = os.environ.get('BUILD_ECHO', '1') != '0'  # BUILD_ECHO=0 keeps build output in build.log only
 
 # ============================================================================
 # GLOBALS
@@ -59,29 +80,134 @@ BUILD_MESSAGE_ID = None
 USE_BANNER = False
 BUILD_PROCESS = None
 LAST_PROGRESS = ""
-
-TELEGRAM_URL = f"https://api.telegram.org/bot{CONFIG_BOT_TOKEN}"
+BUILD_OUTPUT_FAILED = False  # set by the pump on the first FAIL_MARKERS hit
+BUILD_TYPE = 'Official' if 'OFFICIAL' in os.environ else 'Unofficial'
+LAST_EDIT_HASH = {}  # message_id -> hash of the last text/caption Telegram accepted
+TAMINARU_FONT_AVAILABLE = os.path.exists(TAMINARU_FONT)
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ci_bot")
+BANNER_FILE = os.path.join(ROOT_DIR, "build_banner.png")  # banner that could not be cached
+AVATAR_CACHE_TTL = 24 * 3600  # seconds before the org avatar (and banners using it) is refetched
+
+# Last lines of build output, filled by pump_build_output
+LOG_TAIL = deque(maxlen=200)
+LOG_TAIL_LOCK = Lock()
+LOG_UPDATED = Event()
+
+# Set once the build is over so no progress edit (or its retry) lands after the final status
+PROGRESS_STOP = Event()
+MONITOR_THREAD = None
+
+PROGRESS_RE = re.compile(r'\[\s*(\d+)%\s+(\d+)/(\d+)\]')
+PROGRESS_RE2 = re.compile(r'(\d+)%\s+(\d+)/(\d+)')
+
+# GitHub organisation from the manifest remote URL
+GITHUB_ORG_RE = re.compile(r'github\.com[:/]([^/]+)')
+
+# Android version in .repo/manifests/default.xml (tag revision preferred)
+ANDROID_TAG_RE = re.compile(r'revision="refs/tags/android-(\d+)\.')
+ANDROID_VERSION_RE = re.compile(r'android-(\d+)\.\d+\.\d+')
+
+# Markers that flag a build as failed even when it exited with status 0
+FAIL_MARKERS = ('error:', 'FAILED:', 'Cannot locate', 'fatal:', 'panic:')
+
+# ROM zip name prefixes, in priority order, before falling back to any large zip
+ROM_ZIP_PREFIXES = ('axion-', 'lineage-', 'crdroid-', 'voltage-', 'arrow-', 'evolution-')
+
+# Minimum seconds between Telegram progress edits
+PROGRESS_EDIT_INTERVAL = 5
+
+# Back-off bounds (seconds) while output flows but the percentage is unchanged
+PROGRESS_BACKOFF_MIN = 1
+PROGRESS_BACKOFF_MAX = 30
+
+# Seconds to let the pump drain the pipe after the build exits; background
+# children that inherited stdout can keep it open long after that
+PUMP_DRAIN_TIMEOUT = 5
+
+# Shared HTTP session: keeps the TLS connection to Telegram alive between calls.
+# Retry covers connection errors for every request, but status-code retries
+# only for idempotent methods (urllib3 default), so sends are never duplicated.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+))
+
+# Edits are idempotent, so they also get an app-level retry on 429/5xx (which
+# urllib3 won't retry for POST). Backoff doubles with ±30% jitter, capped in total.
+TELEGRAM_EDIT_RETRIES = 3
+TELEGRAM_RETRY_BASE = 0.5
+TELEGRAM_RETRY_BUDGET = 60
+
+# (connect, read) timeouts: small JSON calls fail fast, uploads get room
+TELEGRAM_CONNECT_TIMEOUT = 5
+TELEGRAM_TIMEOUTS = {
+    'sendMessage': 10,
+    'editMessageText': 10,
+    'editMessageCaption': 10,
+    'sendPhoto': 60,
+    'sendDocument': 120,
+}
 
 # ============================================================================
 # BANNER GENERATOR - TAMINARU FONT ONLY
 # ============================================================================
 
+@functools.lru_cache(maxsize=16)
+def _load_taminaru(size):
+    """Load Taminaru font once per size"""
+    return ImageFont.truetype(TAMINARU_FONT, size)
+
+def avatar_cache_file(avatar_url):
+    """Disk cache path for an avatar URL"""
+    url_hash = hashlib.sha1(avatar_url.encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"avatar_{url_hash}.bin")
+
+def fresh_mtime(path, max_age):
+    """mtime of path in ns, or None if it's missing or older than max_age seconds"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return mtime if time.time_ns() - mtime < max_age * 10**9 else None
+
 class BannerGenerator:
     """Banner generator using ONLY Taminaru_Regular.otf"""
 
     def __init__(self, width=1200, height=630):
         self.width = width
         self.height = height
+        self.has_avatar = False  # set by generate(); False means the logo is missing
 
     def fetch_avatar(self, avatar_url):
-        """Fetch avatar from GitHub"""
+        """Fetch avatar from GitHub (cached on disk per URL for AVATAR_CACHE_TTL)"""
+        cache_file = avatar_cache_file(avatar_url)
+        if fresh_mtime(cache_file, AVATAR_CACHE_TTL) is not None:
+            try:
+                # Decode straight from the file; load() reads it now and closes it
+                avatar = Image.open(cache_file)
+                avatar.load()
+                return avatar
+            except:
+                pass  # not a usable image (truncated, HTML error page, ...)
+
         try:
-            response = requests.get(avatar_url, timeout=10)
-            if response.status_code == 200:
-                return Image.open(BytesIO(response.content))
+            response = SESSION.get(avatar_url, timeout=10)
+            response.raise_for_status()
+            avatar = Image.open(BytesIO(response.content))
+            avatar.load()
         except:
-            pass
-        return None
+            return None
+
+        # The cache is an optimisation only: an unwritable ~/.cache must not cost the logo
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(cache_file + '.tmp', 'wb') as f:
+                f.write(response.content)
+            os.replace(cache_file + '.tmp', cache_file)
+        except OSError:
+            discard(cache_file + '.tmp')
+        return avatar
 
     def create_circular_avatar(self, avatar, size=200):
         """Create circular avatar - OLD VERSION (NOT CROPPED)"""
@@ -89,23 +215,19 @@ class BannerGenerator:
         if avatar.mode != 'RGBA':
             avatar = avatar.convert('RGBA')
 
-        # Remove white backgrounds
-        data = list(avatar.getdata())
-        new_data = []
-        for item in data:
-            r, g, b = item[0], item[1], item[2]
-            if r > 240 and g > 240 and b > 240:
-                new_data.append((r, g, b, 0))
-            else:
-                new_data.append(item)
-        avatar.putdata(new_data)
+        # Remove white backgrounds (alpha = 0 where r, g and b are all > 240)
+        r, g, b, a = avatar.split()
+        r, g, b = (band.point(lambda v: 255 if v > 240 else 0) for band in (r, g, b))
+        white = ImageChops.multiply(ImageChops.multiply(r, g), b)
+        avatar.putalpha(ImageChops.subtract(a, white))
 
         # Simple 15% padding for all logos
         padding = int(size * 0.15)
         inner_size = size - (padding * 2)
 
-        # Resize maintaining aspect ratio
-        avatar.thumbnail((inner_size, inner_size), Image.Resampling.LANCZOS)
+        # Resize maintaining aspect ratio; LANCZOS only pays off on big reductions
+        resample = Resampling.LANCZOS if max(avatar.size) > 2 * inner_size else Resampling.BILINEAR
+        avatar.thumbnail((inner_size, inner_size), resample)
 
         # White circular background
         background = Image.new('RGBA', (size, size), (255, 255, 255, 255))
@@ -130,13 +252,9 @@ class BannerGenerator:
         glow = Image.new('RGBA', (glow_size, glow_size), (0, 0, 0, 0))
         glow_draw = ImageDraw.Draw(glow)
 
-        # Draw multiple circles for glow
-        for i in range(20, 0, -2):
-            alpha = int(255 * (i / 20) * 0.3)
-            glow_draw.ellipse(
-                (20-i, 20-i, glow_size-20+i, glow_size-20+i),
-                fill=(255, 255, 255, alpha)
-            )
+        # Single disk softened by one blur pass
+        glow_draw.ellipse((20, 20, glow_size-20, glow_size-20), fill=(255, 255, 255, 90))
+        glow = glow.filter(ImageFilter.GaussianBlur(12))
 
         # Paste circular avatar on glow
         glow.paste(output, (20, 20), output)
@@ -144,11 +262,9 @@ class BannerGenerator:
 
     def get_taminaru_font(self, size, bold=False):
         """Get ONLY Taminaru_Regular.otf font"""
-        TAMINARU_FONT = "/home/some8b/.local/share/fonts/t/Taminaru_Regular.otf"
-
-        if os.path.exists(TAMINARU_FONT):
+        if TAMINARU_FONT_AVAILABLE:
             try:
-                return ImageFont.truetype(TAMINARU_FONT, size)
+                return _load_taminaru(size)
             except Exception as e:
                 print(f"❌ Error loading Taminaru font: {e}")
                 print(f"   File exists: {os.path.exists(TAMINARU_FONT)}")
@@ -176,11 +292,13 @@ class BannerGenerator:
         accent = colors[0]
 
         raw_avatar = self.fetch_avatar(avatar_url)
+        self.has_avatar = raw_avatar is not None
 
         darkened = [tuple(max(0, int(c * 0.15)) for c in color) for color in colors]
         lightened = [tuple(min(255, int(c * 0.45)) for c in color) for color in colors]
 
-        image = Image.new('RGB', (self.width, self.height))
+        # Gradient only varies along y: build one column, then stretch it
+        column = []
         for y in range(self.height):
             progress = y / self.height
             if progress < 0.5:
@@ -191,33 +309,48 @@ class BannerGenerator:
                 start_color = lightened[0 if len(lightened) == 1 else 1]
                 end_color = lightened[1 if len(lightened) < 3 else 2]
                 color = tuple(int(start_color[i] * (1 - local_blend) + end_color[i] * local_blend) for i in range(3))
-            for x in range(self.width):
-                image.putpixel((x, y), color)
-
-        image = image.convert('RGBA')
-
-        card_margin = 60
-        card_layer = Image.new('RGBA', (self.width, self.height), (0, 0, 0, 0))
+            column.append(color + (255,))
+
+        # Built as RGBA so the full canvas is allocated once, with no convert copy
+        image = Image.new('RGBA', (1, self.height))
+        image.putdata(column)
+        image = image.resize((self.width, self.height), Resampling.NEAREST)
+
+        # Overlay layers only cover their own bounding box (plus room for the
+        # blur) and are composited in place, instead of full-canvas copies
+        card_margin, card_pad = 60, 4
+        card_origin = (card_margin - card_pad, card_margin - card_pad)
+        card_layer = Image.new(
+            'RGBA',
+            (self.width - 2 * card_origin[0], self.height - 2 * card_origin[1]),
+            (0, 0, 0, 0)
+        )
         card_draw = ImageDraw.Draw(card_layer)
         card_draw.rounded_rectangle(
-            (card_margin, card_margin, self.width - card_margin, self.height - card_margin),
+            (card_pad, card_pad, card_layer.width - card_pad, card_layer.height - card_pad),
             radius=30, fill=(255, 255, 255, 25), outline=(255, 255, 255, 60), width=2
         )
-        image = Image.alpha_composite(image, card_layer.filter(ImageFilter.GaussianBlur(1)))
+        image.alpha_composite(card_layer.filter(ImageFilter.GaussianBlur(1)), dest=card_origin)
 
         logo_size = 200
         if raw_avatar:
             circular = self.create_circular_avatar(raw_avatar, logo_size)
             logo_x, logo_y = 120, (self.height - circular.height) // 2
 
-            glow_layer = Image.new('RGBA', image.size, (0, 0, 0, 0))
+            glow_blur = 40
             glow_center = (logo_x + circular.width // 2, logo_y + circular.height // 2)
+            glow_extent = logo_size + 3 * glow_blur
+            glow_box = (
+                max(0, glow_center[0] - glow_extent), max(0, glow_center[1] - glow_extent),
+                min(self.width, glow_center[0] + glow_extent), min(self.height, glow_center[1] + glow_extent)
+            )
+            glow_layer = Image.new('RGBA', (glow_box[2] - glow_box[0], glow_box[3] - glow_box[1]), (0, 0, 0, 0))
             ImageDraw.Draw(glow_layer).ellipse(
-                (glow_center[0] - logo_size, glow_center[1] - logo_size,
-                 glow_center[0] + logo_size, glow_center[1] + logo_size),
+                (glow_center[0] - glow_box[0] - logo_size, glow_center[1] - glow_box[1] - logo_size,
+                 glow_center[0] - glow_box[0] + logo_size, glow_center[1] - glow_box[1] + logo_size),
                 fill=(accent[0], accent[1], accent[2], 80)
             )
-            image = Image.alpha_composite(image, glow_layer.filter(ImageFilter.GaussianBlur(40)))
+            image.alpha_composite(glow_layer.filter(ImageFilter.GaussianBlur(glow_blur)), dest=glow_box[:2])
             image.paste(circular, (logo_x, logo_y), circular)
 
         draw = ImageDraw.Draw(image)
@@ -229,11 +362,20 @@ class BannerGenerator:
 
         title_text = title.title()
         max_width = self.width - text_start_x - 50
-        while True:
-            bbox = draw.textbbox((0, 0), title_text, font=title_font)
-            if bbox[2] - bbox[0] <= max_width or len(title_text) <= 4:
-                break
-            title_text = title_text[:-4] + "..."
+        bbox = draw.textbbox((0, 0), title_text, font=title_font)
+        full_width = bbox[2] - bbox[0]
+        if full_width > max_width:
+            # Bisect for the longest prefix that fits with the ellipsis: O(log n) measurements
+            full_title = title_text
+            lo, hi = 1, len(full_title) - 1
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                bbox = draw.textbbox((0, 0), full_title[:mid] + "...", font=title_font)
+                if bbox[2] - bbox[0] <= max_width:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            title_text = full_title[:lo] + "..."
 
         draw.text((text_start_x, title_y), title_text, fill=text_primary, font=title_font)
 
@@ -251,53 +393,125 @@ class BannerGenerator:
 
     def save(self, image, output_path):
         """Save banner"""
-        image.save(output_path, 'PNG', quality=95, optimize=True)
+        # Low zlib level: the banner is uploaded once, encode speed matters more
+        image.save(output_path, 'PNG', compress_level=1)
         return output_path
 
-def generate_build_banner():
-    """Generate build banner with Taminaru font"""
-    output_file = os.path.join(ROOT_DIR, "build_banner.png")
+def banner_cache_file(inputs, avatar_mtime):
+    """Cached banner path for the banner inputs and the avatar download time"""
+    key = hashlib.sha1(f"{inputs}|{avatar_mtime}".encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"build_banner_{key}.png")
+
+def prune_banner_cache():
+    """Drop cached banners old enough that their avatar has expired"""
+    for path in Path(CACHE_DIR).glob("build_banner_*.png"):
+        if fresh_mtime(path, AVATAR_CACHE_TTL) is None:
+            discard(path)
 
+def generate_build_banner():
+    """Generate build banner with Taminaru font (cached by its inputs)"""
     if not PIL_AVAILABLE:
         print("❌ Pillow not installed. Banner disabled.")
         return None
 
+    display_name = ROM_DISPLAY_NAME if ROM_DISPLAY_NAME else ROM_NAME
+    avatar_url = GITHUB_ORG_AVATAR if GITHUB_ORG_AVATAR else 'https://avatars.githubusercontent.com/u/0?v=4'
+
+    inputs = f"{display_name}|{DEVICE}|{ANDROID_VERSION}|{BANNER_COLOR_SCHEME}|{avatar_url}"
+    avatar_file = avatar_cache_file(avatar_url)
+
+    # The key includes when the avatar was downloaded, so a refreshed logo means a new
+    # banner; with no fresh avatar on disk the banner is regenerated (and the logo refetched)
+    avatar_mtime = fresh_mtime(avatar_file, AVATAR_CACHE_TTL)
+    if avatar_mtime is not None:
+        cached = banner_cache_file(inputs, avatar_mtime)
+        if os.path.exists(cached):
+            print("✅ Using cached banner")
+            return cached
+
+    output_file = BANNER_FILE
     try:
         print("📸 Generating banner...")
         generator = BannerGenerator()
 
-        display_name = ROM_DISPLAY_NAME if ROM_DISPLAY_NAME else ROM_NAME
-
         image = generator.generate(
             title=display_name,
-            avatar_url=GITHUB_ORG_AVATAR if GITHUB_ORG_AVATAR else 'https://avatars.githubusercontent.com/u/0?v=4',
+            avatar_url=avatar_url,
             device=DEVICE,
             version=ANDROID_VERSION
         )
 
+        # Only cache a banner with its logo, keyed on the avatar file it was drawn from;
+        # without one (fetch failed, cache unwritable) the next run retries
+        avatar_mtime = fresh_mtime(avatar_file, AVATAR_CACHE_TTL)
+        if generator.has_avatar and avatar_mtime is not None:
+            output_file = banner_cache_file(inputs, avatar_mtime)
+            try:
+                # Write under a temp name so an interrupted save never gets reused
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                generator.save(image, output_file + ".tmp")
+                os.replace(output_file + ".tmp", output_file)
+                prune_banner_cache()
+                print("✅ Banner generated!")
+                return output_file
+            except OSError as e:
+                print(f"⚠️  Banner not cached: {e}")
+                discard(output_file + ".tmp")
+
+        # Uncached banner goes to the build dir and is removed after the run
+        output_file = BANNER_FILE
         generator.save(image, output_file)
         print("✅ Banner generated!")
         return output_file
     except Exception as e:
         print(f"❌ Error generating banner: {e}")
+        discard(output_file + ".tmp")
         return None
 
 # ============================================================================
 # TELEGRAM FUNCTIONS
 # ============================================================================
 
-def telegram_request(endpoint, data=None, files=None, timeout=30):
-    """Send request to Telegram"""
-    url = f"{TELEGRAM_URL}/{endpoint}"
-    try:
-        if files:
-            response = requests.post(url, data=data, files=files, timeout=timeout)
+@functools.lru_cache(maxsize=16)
+def _tg_url(token, method):
+    """Bot API URL for a method (keyed on the token, so runtime config changes apply)"""
+    return f"https://api.telegram.org/bot{token}/{method}"
+
+def telegram_request(endpoint, data=None, files=None, timeout=None, retries=0, cancel=None):
+    """Send request to Telegram, retrying transient failures up to `retries` times (until `cancel` is set)"""
+    url = _tg_url(CONFIG_BOT_TOKEN, endpoint)
+    timeout = (TELEGRAM_CONNECT_TIMEOUT, timeout or TELEGRAM_TIMEOUTS.get(endpoint, 30))
+    deadline = time.monotonic() + TELEGRAM_RETRY_BUDGET
+    for attempt in range(retries + 1):
+        if attempt and cancel is not None and cancel.is_set():
+            return None
+        try:
+            if files:
+                response = SESSION.post(url, data=data, files=files, timeout=timeout)
+            else:
+                response = SESSION.post(url, json=data, timeout=timeout)
+            result = response.json()
+            if result.get('ok'):
+                return result
+            # Bad request, "message is not modified", etc. won't fix themselves
+            error_code = result.get('error_code', 0)
+            if error_code != 429 and error_code < 500:
+                return None
+            # Flood control tells us exactly how long to wait
+            retry_after = result.get('parameters', {}).get('retry_after')
+        except (requests.RequestException, ValueError):
+            retry_after = None
+
+        delay = retry_after or TELEGRAM_RETRY_BASE * 2 ** attempt * random.uniform(0.7, 1.3)
+        if attempt == retries or time.monotonic() + delay > deadline:
+            break
+        # A retry_after wait can be long: wake early if the caller cancels
+        if cancel is not None:
+            if cancel.wait(delay):
+                return None
         else:
-            response = requests.post(url, json=data, timeout=timeout)
-        result = response.json()
-        return result if result.get('ok') else None
-    except:
-        return None
+            time.sleep(delay)
+    return None
 
 def send_message(text):
     """Send text message"""
@@ -329,11 +543,46 @@ def send_file(file_path):
     with open(file_path, 'rb') as file:
         files = {'document': file}
         data = {'chat_id': CONFIG_CHATID}
-        result = telegram_request('sendDocument', data=data, files=files, timeout=120)
+        result = telegram_request('sendDocument', data=data, files=files)
         return result['result']['message_id'] if result else None
 
-def edit_message(message_id, text):
-    """Edit text message"""
+def compress_log(file_path):
+    """Compress a log for upload (zstd if installed, gzip otherwise)"""
+    output_path = file_path + ('.zst' if ZSTD_AVAILABLE else '.gz')
+    try:
+        if ZSTD_AVAILABLE:
+            compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+            with open(file_path, 'rb') as src, open(output_path, 'wb') as dst:
+                fadvise(src, 'SEQUENTIAL')
+                compressor.copy_stream(src, dst)
+        else:
+            with open(file_path, 'rb') as src, gzip.open(output_path, 'wb', compresslevel=6) as dst:
+                fadvise(src, 'SEQUENTIAL')
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    except:
+        # Don't leave a truncated archive next to the log (e.g. ENOSPC midway)
+        discard(output_path)
+        raise
+    return output_path
+
+def send_log(file_path):
+    """Send a log file compressed, falling back to the raw file"""
+    if not os.path.exists(file_path):
+        return None
+    try:
+        compressed = compress_log(file_path)
+    except Exception as e:
+        print(f"⚠️  Could not compress {os.path.basename(file_path)}: {e}")
+        return send_file(file_path)
+    try:
+        return send_file(compressed)
+    finally:
+        Path(compressed).unlink(missing_ok=True)
+
+def edit_message(message_id, text, cancel=None):
+    """Edit text message (skipped if unchanged)"""
+    if LAST_EDIT_HASH.get(message_id) == hash(text):
+        return None
     data = {
         'chat_id': CONFIG_CHATID,
         'message_id': message_id,
@@ -341,30 +590,35 @@ def edit_message(message_id, text):
         'parse_mode': 'HTML',
         'disable_web_page_preview': True
     }
-    return telegram_request('editMessageText', data=data)
-
-def edit_photo_caption(message_id, caption):
-    """Edit photo caption"""
+    result = telegram_request('editMessageText', data=data, retries=TELEGRAM_EDIT_RETRIES, cancel=cancel)
+    if result:
+        LAST_EDIT_HASH[message_id] = hash(text)
+    return result
+
+def edit_photo_caption(message_id, caption, cancel=None):
+    """Edit photo caption (skipped if unchanged)"""
+    if LAST_EDIT_HASH.get(message_id) == hash(caption):
+        return None
     data = {
         'chat_id': CONFIG_CHATID,
         'message_id': message_id,
         'caption': caption,
         'parse_mode': 'HTML'
     }
-    return telegram_request('editMessageCaption', data=data)
+    result = telegram_request('editMessageCaption', data=data, retries=TELEGRAM_EDIT_RETRIES, cancel=cancel)
+    if result:
+        LAST_EDIT_HASH[message_id] = hash(caption)
+    return result
 
 # ============================================================================
 # BUILD FUNCTIONS
 # ============================================================================
 
 def get_build_progress():
-    """Extract progress from build.log"""
-    if not os.path.exists(BUILD_LOG):
-        return "Initializing..."
-
+    """Extract progress from the last lines of build output"""
     try:
-        with open(BUILD_LOG, 'r') as f:
-            lines = f.readlines()[-200:]
+        with LOG_TAIL_LOCK:
+            lines = list(LOG_TAIL)
 
         # Check for packaging stage
         for line in reversed(lines[:100]):
@@ -377,8 +631,9 @@ def get_build_progress():
 
         # Find progress percentage
         for line in reversed(lines):
-            match = re.search(r'\[\s*(\d+)%\s+(\d+)/(\d+)\]', line) or \
-                    re.search(r'(\d+)%\s+(\d+)/(\d+)', line)
+            if '%' not in line:  # cheap reject before either regex
+                continue
+            match = PROGRESS_RE.search(line) or PROGRESS_RE2.search(line)
             if match:
                 return f"{match.group(1)}% ({match.group(2)}/{match.group(3)})"
 
@@ -390,68 +645,160 @@ def get_build_progress():
     except:
         return "Initializing..."
 
-def tail_build_log():
-    """Print build log to console"""
-    last_pos = 0
-    while BUILD_PROCESS and BUILD_PROCESS.poll() is None:
-        if os.path.exists(BUILD_LOG):
+def pump_warning(message):
+    """Best-effort warning on stderr (which may itself be gone)"""
+    try:
+        print(message, file=sys.stderr)
+    except (OSError, ValueError):
+        pass
+
+def pump_build_output(log_file):
+    """Copy build output to build.log and the console, and keep LOG_TAIL current"""
+    global BUILD_OUTPUT_FAILED
+    # This is the pipe's only reader: a failing sink is dropped, never allowed to
+    # stop the loop, or the build would block once the pipe buffer fills
+    write_log, echo = True, ECHO_BUILD_OUTPUT
+    for line in BUILD_PROCESS.stdout:
+        if write_log:
             try:
-                with open(BUILD_LOG, 'r') as f:
-                    f.seek(last_pos)
-                    for line in f:
-                        print(line.rstrip())
-                    last_pos = f.tell()
-            except:
-                pass
-        time.sleep(0.5)
+                log_file.write(line)
+            except (OSError, ValueError) as e:
+                write_log = False
+                pump_warning(f"⚠️  Stopped writing {BUILD_LOG}: {e}")
+        if echo:
+            try:
+                sys.stdout.write(line)
+            except (OSError, ValueError) as e:
+                echo = False
+                pump_warning(f"⚠️  Stopped echoing build output: {e}")
+        # Failure markers are checked here, so build.log never has to be re-read
+        if not BUILD_OUTPUT_FAILED and any(marker in line for marker in FAIL_MARKERS):
+            BUILD_OUTPUT_FAILED = True
+        with LOG_TAIL_LOCK:
+            LOG_TAIL.append(line)
+        LOG_UPDATED.set()
+    LOG_UPDATED.set()
 
 def monitor_progress():
     """Update Telegram with progress"""
     global LAST_PROGRESS
+    backoff = PROGRESS_BACKOFF_MIN
 
-    while BUILD_PROCESS and BUILD_PROCESS.poll() is None:
-        current_progress = get_build_progress()
-
-        if current_progress != LAST_PROGRESS:
-            print(f"\n🔨 Progress: {current_progress}\n", file=sys.stderr)
-
-            # Prepare caption based on banner usage
-            if USE_BANNER:
-                caption = f"""<b>🔨 Building {ROM_NAME}</b>
+    # Everything but the progress value is fixed for the whole build
+    if USE_BANNER:
+        edit, tail = edit_photo_caption, ""
+        head = f"""<b>🔨 Building {ROM_NAME}</b>
 
 <b>Device:</b> {DEVICE} | <b>Android:</b> {ANDROID_VERSION}
-<b>Type:</b> {'Official' if 'OFFICIAL' in os.environ else 'Unofficial'}
+<b>Type:</b> {BUILD_TYPE}
 
-<b>⏳ Progress:</b> {current_progress}"""
-
-                edit_photo_caption(BUILD_MESSAGE_ID, caption)
-            else:
-                text = f"""🟡 | <i>Compiling ROM...</i>
+<b>⏳ Progress:</b> """
+    else:
+        edit, tail = edit_message, "</code>"
+        head = f"""🟡 | <i>Compiling ROM...</i>
 
 <b>• ROM:</b> <code>{ROM_NAME}</code>
 <b>• DEVICE:</b> <code>{DEVICE}</code>
 <b>• ANDROID VERSION:</b> <code>{ANDROID_VERSION}</code>
-<b>• TYPE:</b> <code>{'Official' if 'OFFICIAL' in os.environ else 'Unofficial'}</code>
-<b>• PROGRESS:</b> <code>{current_progress}</code>"""
+<b>• TYPE:</b> <code>{BUILD_TYPE}</code>
+<b>• PROGRESS:</b> <code>"""
 
-                edit_message(BUILD_MESSAGE_ID, text)
+    while BUILD_PROCESS and BUILD_PROCESS.poll() is None and not PROGRESS_STOP.is_set():
+        # Sleep until the reader thread sees new output (or the timeout passes)
+        LOG_UPDATED.wait(timeout=30)
+        LOG_UPDATED.clear()
+        if BUILD_PROCESS.poll() is not None or PROGRESS_STOP.is_set():
+            break
+
+        current_progress = get_build_progress()
+
+        # Only edit when the percentage (not just the action count) moved
+        if current_progress.partition(' (')[0] != LAST_PROGRESS.partition(' (')[0]:
+            print(f"\n🔨 Progress: {current_progress}\n", file=sys.stderr)
+            edit(BUILD_MESSAGE_ID, f"{head}{current_progress}{tail}", cancel=PROGRESS_STOP)
 
             LAST_PROGRESS = current_progress
+            backoff = PROGRESS_BACKOFF_MIN
+
+            # Coalesce bursts: no further edit is allowed before this anyway
+            PROGRESS_STOP.wait(PROGRESS_EDIT_INTERVAL)
+        else:
+            # Output is flowing but the percentage is not: check less often
+            PROGRESS_STOP.wait(backoff)
+            backoff = min(backoff * 2, PROGRESS_BACKOFF_MAX)
+
+def stop_progress_monitor():
+    """Stop monitor_progress and wait for any in-flight edit before the final status"""
+    PROGRESS_STOP.set()
+    LOG_UPDATED.set()
+    if MONITOR_THREAD and MONITOR_THREAD.is_alive():
+        MONITOR_THREAD.join()
+
+def file_size(path):
+    """Size of a file in bytes (one stat), 0 if it doesn't exist"""
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
 
-        time.sleep(3)
+def discard(path):
+    """Remove a file if it's there; never raises (e.g. unwritable cache dir)"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
 
 def find_rom_zip():
     """Find main ROM zip file"""
-    patterns = ['axion-*.zip', 'lineage-*.zip', 'crdroid-*.zip',
-                'voltage-*.zip', 'arrow-*.zip', 'evolution-*.zip', '*.zip']
-
-    for pattern in patterns:
-        files = [f for f in Path(OUT_DIR).glob(pattern)
-                if 'ota' not in f.name.lower() and 'img' not in f.name.lower()
-                and f.stat().st_size > 500 * 1024 * 1024]
-        if files:
-            return str(max(files, key=lambda f: f.stat().st_mtime))
-    return None
+    # One directory pass; DirEntry.stat() is cached, so each zip is stat'ed once.
+    # Best (mtime, path) per prefix rank; rank len(ROM_ZIP_PREFIXES) is "any zip".
+    best = {}
+    try:
+        with os.scandir(OUT_DIR) as entries:
+            for entry in entries:
+                name = entry.name.lower()
+                if not entry.name.endswith('.zip') or 'ota' in name or 'img' in name:
+                    continue
+
+                stat = entry.stat()
+                if stat.st_size <= 500 * 1024 * 1024:
+                    continue
+
+                rank = next((i for i, prefix in enumerate(ROM_ZIP_PREFIXES)
+                             if entry.name.startswith(prefix)), len(ROM_ZIP_PREFIXES))
+                if rank not in best or stat.st_mtime > best[rank][0]:
+                    best[rank] = (stat.st_mtime, entry.path)
+    except FileNotFoundError:
+        return None
+
+    return best[min(best)][1] if best else None
+
+def fadvise(f, advice):
+    """Pass a posix_fadvise hint for a whole file (no-op where unsupported)"""
+    advice = getattr(os, f'POSIX_FADV_{advice}', None)
+    if advice is None:
+        return
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, advice)
+    except OSError:
+        pass
+
+def md5sum(path):
+    """MD5 of a file, hashed in C via hashlib.file_digest when available"""
+    with open(path, 'rb') as f:
+        # Full readahead while hashing; drop the ROM from page cache afterwards
+        fadvise(f, 'SEQUENTIAL')
+        try:
+            if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+                return hashlib.file_digest(f, 'md5').hexdigest()
+            # Older Pythons: reuse one buffer rather than allocating per chunk
+            md5_hash = hashlib.md5()
+            buffer = memoryview(bytearray(4 * 1024 * 1024))
+            while size := f.readinto(buffer):
+                md5_hash.update(buffer[:size])
+            return md5_hash.hexdigest()
+        finally:
+            fadvise(f, 'DONTNEED')
 
 def get_rom_info():
     """Get ROM name and avatar from GitHub"""
@@ -473,7 +820,7 @@ def get_rom_info():
 
         if result.returncode == 0:
             remote_url = result.stdout.strip()
-            match = re.search(r'github\.com[:/]([^/]+)', remote_url)
+            match = GITHUB_ORG_RE.search(remote_url)
             if match:
                 github_org = match.group(1)
                 # Only override ROM_NAME if not set by user
@@ -488,14 +835,18 @@ def detect_android_version():
     default_manifest = os.path.join(ROOT_DIR, '.repo/manifests/default.xml')
     if os.path.exists(default_manifest):
         try:
+            fallback = None
             with open(default_manifest, 'r') as f:
-                content = f.read()
-                match = re.search(r'revision="refs/tags/android-(\d+)\.', content)
-                if match:
-                    return match.group(1)
-                match = re.search(r'android-(\d+)\.\d+\.\d+', content)
-                if match:
-                    return match.group(1)
+                for line in f:
+                    match = ANDROID_TAG_RE.search(line)
+                    if match:
+                        return match.group(1)
+                    if fallback is None:
+                        match = ANDROID_VERSION_RE.search(line)
+                        if match:
+                            fallback = match.group(1)
+            if fallback:
+                return fallback
         except:
             pass
     return "Unknown"
@@ -508,6 +859,8 @@ def handle_interrupt(signum, frame):
     if BUILD_PROCESS:
         BUILD_PROCESS.terminate()
 
+    stop_progress_monitor()
+
     if BUILD_MESSAGE_ID:
         msg = f"""⚠️ | <i>Build interrupted by user</i>
 
@@ -518,11 +871,7 @@ def handle_interrupt(signum, frame):
 
         (edit_photo_caption if USE_BANNER else edit_message)(BUILD_MESSAGE_ID, msg)
 
-    # Cleanup banner
-    banner_path = Path(os.path.join(ROOT_DIR, 'build_banner.png'))
-    if banner_path.exists():
-        banner_path.unlink()
-
+    Path(BANNER_FILE).unlink(missing_ok=True)
     sys.exit(130)
 
 # ============================================================================
@@ -530,7 +879,7 @@ def handle_interrupt(signum, frame):
 # ============================================================================
 
 def main():
-    global BUILD_MESSAGE_ID, USE_BANNER, BUILD_PROCESS, LAST_PROGRESS, ANDROID_VERSION
+    global BUILD_MESSAGE_ID, USE_BANNER, BUILD_PROCESS, LAST_PROGRESS, ANDROID_VERSION, MONITOR_THREAD
 
     signal.signal(signal.SIGINT, handle_interrupt)
 
@@ -545,8 +894,8 @@ def main():
     print(f"🤖 Android: {ANDROID_VERSION}")
 
     # Clean old logs
-    for log_file in ['out/error.log', 'out/.lock', BUILD_LOG]:
-        Path(log_file).unlink(missing_ok=True)
+    for log_file in ('out/error.log', 'out/.lock', BUILD_LOG):
+        Path(ROOT_DIR, log_file).unlink(missing_ok=True)
 
     # Generate and send banner
     banner_file = generate_build_banner()
@@ -556,7 +905,7 @@ def main():
         caption = f"""<b>🔨 Building {ROM_NAME}</b>
 
 <b>Device:</b> {DEVICE} | <b>Android:</b> {ANDROID_VERSION}
-<b>Type:</b> {'Official' if 'OFFICIAL' in os.environ else 'Unofficial'}
+<b>Type:</b> {BUILD_TYPE}
 
 <b>⏳ Status:</b> Initializing build..."""
 
@@ -570,7 +919,7 @@ def main():
 <b>• ROM:</b> <code>{ROM_NAME}</code>
 <b>• DEVICE:</b> <code>{DEVICE}</code>
 <b>• ANDROID VERSION:</b> <code>{ANDROID_VERSION}</code>
-<b>• TYPE:</b> <code>{'Official' if 'OFFICIAL' in os.environ else 'Unofficial'}</code>
+<b>• TYPE:</b> <code>{BUILD_TYPE}</code>
 <b>• PROGRESS:</b> <code>Initializing...</code>"""
         BUILD_MESSAGE_ID = send_message(text)
 
@@ -592,41 +941,48 @@ def main():
 
     print(f"Log file: {BUILD_LOG}\n")
 
-    # Start build
-    with open(BUILD_LOG, 'w') as log_file:
-        BUILD_PROCESS = subprocess.Popen(
-            build_cmd, shell=True, executable='/bin/bash',
-            stdout=log_file, stderr=subprocess.STDOUT
-        )
+    # Start build; one reader thread fans output out to log, console and progress
+    log_file = open(BUILD_LOG, 'w', buffering=1)  # line-buffered: tail -f and Ctrl+C see every line
+    BUILD_PROCESS = subprocess.Popen(
+        ['/bin/bash', '-c', build_cmd],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        text=True, errors='replace', bufsize=1
+    )
 
     # Monitor build
-    Thread(target=tail_build_log, daemon=True).start()
-    Thread(target=monitor_progress, daemon=True).start()
+    pump = Thread(target=pump_build_output, args=(log_file,), daemon=True)
+    pump.start()
+    MONITOR_THREAD = Thread(target=monitor_progress, daemon=True)
+    MONITOR_THREAD.start()
 
     # Wait for completion
     BUILD_PROCESS.wait()
+    pump.join(PUMP_DRAIN_TIMEOUT)
+    if pump.is_alive():
+        print("⚠️  Build output still open after exit (background process?); not waiting for it", file=sys.stderr)
+    try:
+        log_file.close()
+    except OSError as e:  # e.g. ENOSPC flushing the last buffered lines
+        print(f"⚠️  Could not finish writing {BUILD_LOG}: {e}", file=sys.stderr)
+
+    # Progress edits must be finished before any final status is posted
+    stop_progress_monitor()
     build_duration = int(time.time() - build_start_time)
 
     # Check for errors
     error_log = 'out/error.log'
+    error_log_size = file_size(error_log)
     build_failed = False
 
     if BUILD_PROCESS.returncode != 0:
         build_failed = True
         print(f"❌ Build failed")
-    elif os.path.exists(error_log) and os.path.getsize(error_log) > 0:
+    elif error_log_size > 0:
+        build_failed = True
+        print("❌ Build failed!")
+    elif BUILD_OUTPUT_FAILED:
         build_failed = True
         print("❌ Build failed!")
-    elif os.path.exists(BUILD_LOG):
-        try:
-            with open(BUILD_LOG, 'r') as f:
-                log_content = f.read()
-                if any(pattern in log_content for pattern in
-                       ['error:', 'FAILED:', 'Cannot locate', 'fatal:', 'panic:']):
-                    build_failed = True
-                    print("❌ Build failed!")
-        except:
-            pass
 
     if build_failed:
         # Get last progress for error message
@@ -648,9 +1004,10 @@ def main():
         (edit_photo_caption if USE_BANNER else edit_message)(BUILD_MESSAGE_ID, fail_msg)
 
         # Send error logs
-        for log_file in [error_log, BUILD_LOG]:
-            if os.path.exists(log_file) and os.path.getsize(log_file) > 0:
-                send_file(log_file)
+        if error_log_size > 0:
+            send_file(error_log)
+        if file_size(BUILD_LOG) > 0:
+            send_log(BUILD_LOG)
     else:
         print("✅ Build succeeded!")
 
@@ -662,12 +1019,13 @@ def main():
 
         print(f"📦 Found ROM: {os.path.basename(rom_zip)}")
 
+        # Upload the build log while the ROM is hashed; neither needs the other
+        log_upload = Thread(target=send_log, args=(BUILD_LOG,))
+        log_upload.start()
+
         # Calculate MD5
         print("🔍 Calculating MD5...")
-        md5_hash = hashlib.md5()
-        with open(rom_zip, 'rb') as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                md5_hash.update(chunk)
+        rom_md5 = md5sum(rom_zip)
 
         rom_filename = os.path.basename(rom_zip)
         rom_size = os.path.getsize(rom_zip) / (1024**3)
@@ -680,7 +1038,7 @@ def main():
         success_msg = f"""<b>✅ {ROM_NAME} Build Complete!</b>
 
 <b>Device:</b> {DEVICE} | <b>Android:</b> {ANDROID_VERSION}
-<b>Type:</b> {'Official' if 'OFFICIAL' in os.environ else 'Unofficial'}
+<b>Type:</b> {BUILD_TYPE}
 
 <b>📊 Stats:</b>
 <b>• Duration:</b> {time_str}
@@ -688,20 +1046,17 @@ def main():
 <b>🔧 File:</b>
 <b>• Name:</b> <code>{html_escape(rom_filename)}</code>
 <b>• Size:</b> {rom_size:.2f} GiB
-<b>• MD5:</b> <code>{md5_hash.hexdigest()}</code>
+<b>• MD5:</b> <code>{rom_md5}</code>
 
 <b>📁 Status:</b> Files saved locally"""
 
         (edit_photo_caption if USE_BANNER else edit_message)(BUILD_MESSAGE_ID, success_msg)
 
-        # Send build log
-        if os.path.exists(BUILD_LOG):
-            send_file(BUILD_LOG)
+        # Wait for the build log upload
+        log_upload.join()
 
     # Cleanup
-    banner_path = Path(os.path.join(ROOT_DIR, 'build_banner.png'))
-    if banner_path.exists():
-        banner_path.unlink()
+    Path(BANNER_FILE).unlink(missing_ok=True)
 
     print(f"\n{'❌' if build_failed else '✅'} Build {'failed' if build_failed else 'completed'} in {build_duration//60}m {build_duration%60}s")
     print("=" * 60)